@@ -0,0 +1,34 @@
+r"""
+App for the worker lifecycle benchmark. Workers run in subprocesses, so the
+in-memory broker cannot be used; the filesystem transport keeps it offline.
+"""
+import os
+import tempfile
+
+from celery_center import CeleryCenter
+
+
+BENCH_DIR = os.environ.setdefault('CC_BENCH_DIR', tempfile.mkdtemp(prefix='cc-bench-'))
+for _name in ('broker', 'control', 'results'):
+    os.makedirs(os.path.join(BENCH_DIR, _name), exist_ok=True)
+
+
+celery_center = CeleryCenter()
+
+
+@celery_center.task(name='bench.noop')
+def noop(x):
+    return x
+
+
+celery = celery_center.create_celery(
+    main='bench_app',
+    broker='filesystem://',
+    backend=f'file://{os.path.join(BENCH_DIR, "results")}',
+)
+celery.conf.broker_transport_options = {
+    'data_folder_in': os.path.join(BENCH_DIR, 'broker'),
+    'data_folder_out': os.path.join(BENCH_DIR, 'broker'),
+    'control_folder': os.path.join(BENCH_DIR, 'control'),
+    'polling_interval': 0.05,
+}
@@ -0,0 +1,86 @@
+r"""
+Per-task overhead of the Flask app context modes and of worker-local
+resources, measured by calling the task in-process (no broker).
+"""
+import time
+import sqlite3
+from typing import Dict, Any
+
+import common
+from celery_center import CeleryCenter, WorkerLocal
+
+
+def _per_task_us(task, n: int) -> float:
+    for i in range(min(n, 100)):
+        task(i)
+    t = time.perf_counter()
+    for i in range(n):
+        task(i)
+    return (time.perf_counter() - t) / n * 1e6
+
+
+def bench_app_context(n: int = 20000) -> Dict[str, Any]:
+    try:
+        from flask import Flask, g
+    except ImportError:
+        return {'skipped': 'flask is not installed'}
+
+    res = dict()
+    for mode in ('task', 'thread'):
+        flask_app = Flask('bench')
+        flask_app.config['CELERY_BROKER_URL'] = 'memory://'
+        teardowns = list()
+
+        @flask_app.teardown_appcontext
+        def teardown(exc):
+            teardowns.append(exc)
+
+        center = CeleryCenter()
+
+        @center.task(name='bench.ctx')
+        def ctx_task(x):
+            g.x = x
+            return x
+
+        app = center.create_celery(app=flask_app, app_context=mode, instrument=False)
+        res[mode] = {'per_task_us': _per_task_us(app.tasks['bench.ctx'], n)}
+        assert len(teardowns) == n + min(n, 100)
+    res['saved_us'] = res['task']['per_task_us'] - res['thread']['per_task_us']
+    return res
+
+
+def bench_worker_local(n: int = 20000) -> Dict[str, Any]:
+    center = CeleryCenter()
+    conn = WorkerLocal(lambda: sqlite3.connect(':memory:'), close=lambda c: c.close())
+
+    @center.task(name='bench.new_conn')
+    def new_conn(x):
+        c = sqlite3.connect(':memory:')
+        try:
+            return c.execute('select ?', (x,)).fetchone()[0]
+        finally:
+            c.close()
+
+    @center.task(name='bench.local_conn')
+    def local_conn(x):
+        return conn.get().execute('select ?', (x,)).fetchone()[0]
+
+    app = center.create_celery(broker='memory://', instrument=False)
+    res = {
+        'per_task': {'per_task_us': _per_task_us(app.tasks['bench.new_conn'], n)},
+        'worker_local': {'per_task_us': _per_task_us(app.tasks['bench.local_conn'], n)},
+    }
+    res['saved_us'] = res['per_task']['per_task_us'] - res['worker_local']['per_task_us']
+    conn.close_all()
+    return res
+
+
+def run(n: int = 20000) -> Dict[str, Any]:
+    res = {
+        'app_context': bench_app_context(n),
+        'worker_local': bench_worker_local(n),
+    }
+    for name, r in res.items():
+        if 'saved_us' in r:
+            print(f'{name}: {r["saved_us"]:.1f} us saved per task')
+    return res
@@ -0,0 +1,53 @@
+r"""
+Spawn, ready and shutdown time of workers started through `WorkerProcess`.
+"""
+import os
+import sys
+import time
+from typing import Dict, List, Any
+
+from common import percentiles
+
+
+def bench_lifecycle(pool: str = 'solo', n: int = 5) -> Dict[str, Any]:
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    # `celery -A bench_app` in the worker subprocess has to find the app
+    os.environ['PYTHONPATH'] = os.pathsep.join(
+        [bench_dir, *filter(None, [os.environ.get('PYTHONPATH')])])
+    if bench_dir not in sys.path:
+        sys.path.insert(0, bench_dir)
+    from celery_center.control.worker_control_center import WorkerProcess
+
+    spawn, ready, shutdown = list(), list(), list()
+    for i in range(n):
+        wp = WorkerProcess(
+            'bench_app.celery',
+            f'bench{i}',
+            pool=pool,
+            loglevel='ERROR',
+        )
+        t0 = time.perf_counter()
+        wp.start()
+        t1 = time.perf_counter()
+        if not wp.wait_for_ready():
+            raise RuntimeError(f'worker `{wp.hostname}` exited before ready')
+        t2 = time.perf_counter()
+        wp.shutdown(join=True, timeout=60)
+        t3 = time.perf_counter()
+        spawn.append(t1 - t0)
+        ready.append(t2 - t0)
+        shutdown.append(t3 - t2)
+    return {
+        'n': n,
+        'spawn_s': percentiles(spawn),
+        'ready_s': percentiles(ready),
+        'shutdown_s': percentiles(shutdown),
+    }
+
+
+def run(pools: List[str] = ['solo', 'threads', 'prefork'], n: int = 5) -> Dict[str, Any]:
+    res = dict()
+    for pool in pools:
+        res[pool] = bench_lifecycle(pool, n=n)
+        print(f'{pool}: ready in {res[pool]["ready_s"]["p50"]:.2f}s')
+    return res
@@ -0,0 +1,139 @@
+r"""
+Task round-trip latency and throughput with an in-process worker.
+"""
+import time
+from typing import Dict, List, Any
+
+from click import Option
+from celery import Task
+
+from common import create_app, run_worker, wait, percentiles
+from celery_center import CeleryCenter
+from celery_center.control.base import WorkspaceBase
+
+
+def build_center(work_ms: float = 0.0) -> CeleryCenter:
+    center = CeleryCenter()
+
+    @center.task(name='bench.noop')
+    def noop(x):
+        if work_ms > 0:
+            time.sleep(work_ms / 1000)
+        return x
+
+    return center
+
+
+class BenchWorkspace(WorkspaceBase):
+    @classmethod
+    def options(cls, defaults: dict = dict()):
+        return [
+            Option(
+                ('--bench-size', 'bench_size'),
+                default=defaults.get('bench_size', 1000),
+                type=int,
+            ),
+        ]
+
+    @classmethod
+    def register_workspace(cls, **kwargs):
+        return cls(kwargs.get('bench_size', 1000))
+
+    def __init__(self, size: int):
+        self.table = list(range(size))
+
+    def lookup(self, i: int) -> int:
+        return self.table[i % len(self.table)]
+
+    def terminate(self):
+        pass
+
+
+def build_workspace_center() -> CeleryCenter:
+    center = CeleryCenter()
+
+    class BenchWorkspaceTask(Task):
+        workspace = None
+
+    center.add_workspace(BenchWorkspace, [BenchWorkspaceTask])
+
+    @center.task(base=BenchWorkspaceTask, bind=True, name='bench.lookup')
+    def lookup(task, i):
+        return task.workspace.lookup(i)
+
+    return center
+
+
+def bench_roundtrip(pool: str, n: int = 200, warmup: int = 20, **kwargs) -> Dict[str, Any]:
+    r"""
+    Sequential `delay().get()`, latency of each call in milliseconds.
+    """
+    center = build_center()
+    app = create_app(center, **kwargs)
+    noop = app.tasks['bench.noop']
+    with run_worker(app, pool=pool, concurrency=1):
+        for i in range(warmup):
+            wait(noop.delay(i))
+        latencies = list()
+        for i in range(n):
+            t = time.perf_counter()
+            wait(noop.delay(i))
+            latencies.append((time.perf_counter() - t) * 1000)
+    return {'n': n, 'latency_ms': percentiles(latencies)}
+
+
+def _throughput(app, task_name: str, pool: str, concurrency: int, n: int) -> Dict[str, Any]:
+    task = app.tasks[task_name]
+    with run_worker(app, pool=pool, concurrency=concurrency):
+        wait(task.delay(0))
+        t = time.perf_counter()
+        results = [task.delay(i) for i in range(n)]
+        published = time.perf_counter() - t
+        for r in results:
+            wait(r)
+        elapsed = time.perf_counter() - t
+    return {
+        'n': n,
+        'seconds': elapsed,
+        'tasks_per_second': n / elapsed,
+        'publish_per_second': n / published,
+    }
+
+
+def bench_throughput(
+        pool: str,
+        concurrency: int,
+        n: int = 500,
+        work_ms: float = 0.0,
+        **kwargs
+        ) -> Dict[str, Any]:
+    app = create_app(build_center(work_ms=work_ms), **kwargs)
+    return _throughput(app, 'bench.noop', pool, concurrency, n)
+
+
+def bench_workspace(pool: str, concurrency: int, n: int = 500, **kwargs) -> Dict[str, Any]:
+    app = create_app(build_workspace_center(), **kwargs)
+    return _throughput(app, 'bench.lookup', pool, concurrency, n)
+
+
+def run(
+        pools: List[str] = ['solo', 'threads', 'prefork'],
+        concurrencies: List[int] = [1, 4],
+        n: int = 500,
+        work_ms: float = 1.0,
+        instrument: bool = True,
+        ) -> Dict[str, Any]:
+    res = {'roundtrip': dict(), 'throughput': dict(), 'workspace': dict()}
+    for pool in pools:
+        res['roundtrip'][pool] = bench_roundtrip(
+            pool, n=max(n // 5, 1), instrument=instrument)
+        for c in concurrencies:
+            if pool == 'solo' and c > 1:
+                continue
+            key = f'{pool}-{c}'
+            res['throughput'][key] = bench_throughput(
+                pool, c, n=n, work_ms=work_ms, instrument=instrument)
+            res['workspace'][key] = bench_workspace(
+                pool, c, n=n, instrument=instrument)
+            print(f'{key}: {res["throughput"][key]["tasks_per_second"]:.1f} tasks/s')
+    return res
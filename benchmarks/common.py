@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+
+import celery
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from celery_center import CeleryCenter
+from celery_center.traffic import percentiles
+
+
+POLLING_INTERVAL = 0.001
+# The in-memory transport resumes consuming about a second after the
+# prefetch window is full, which dominates bursts on the threads pool.
+# 0 is unlimited prefetch.
+PREFETCH_MULTIPLIER = 0
+
+
+def create_app(
+        center: CeleryCenter,
+        result_dir: Optional[str] = None,
+        **kwargs
+        ) -> Celery:
+    r"""
+    Offline app: in-memory broker and a `file://` result backend, which is
+    shared with the prefork children unlike `cache+memory://`.
+    """
+    if result_dir is None:
+        result_dir = tempfile.mkdtemp(prefix='cc-bench-')
+    app = center.create_celery(
+        main='bench',
+        broker='memory://',
+        backend=f'file://{result_dir}',
+        **kwargs
+    )
+    app.conf.broker_transport_options = {'polling_interval': POLLING_INTERVAL}
+    app.conf.worker_prefetch_multiplier = PREFETCH_MULTIPLIER
+    return app
+
+
+@contextmanager
+def run_worker(app: Celery, pool: str = 'threads', concurrency: int = 1, **kwargs):
+    with start_worker(
+            app,
+            pool=pool,
+            concurrency=concurrency,
+            perform_ping_check=False,
+            loglevel='ERROR',
+            **kwargs) as worker:
+        yield worker
+
+
+def wait(result, timeout: float = 30.0):
+    return result.get(timeout=timeout, interval=POLLING_INTERVAL)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'celery': celery.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(results: Dict[str, Any], path: Optional[str] = None) -> str:
+    if path is None:
+        dirname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        os.makedirs(dirname, exist_ok=True)
+        path = os.path.join(dirname, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w') as fp:
+        json.dump({'env': environment(), 'results': results}, fp, indent=2)
+    return path
+
+
+def flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    r"""
+    {'a': {'b': 1}} -> {'a.b': 1}, used to compare two runs.
+    """
+    res = dict()
+    for k, v in results.items():
+        key = f'{prefix}.{k}' if prefix else str(k)
+        if isinstance(v, dict):
+            res.update(flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            res[key] = v
+    return res
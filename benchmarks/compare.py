@@ -0,0 +1,49 @@
+r"""
+Compare two result files of `run.py`.
+
+    $ python benchmarks/compare.py base.json new.json --threshold 10
+"""
+import json
+import argparse
+
+from common import flatten
+
+
+# higher is better for these metrics, lower is better for the others
+HIGHER_IS_BETTER = ('tasks_per_second', 'publish_per_second', 'saved_us')
+
+
+def compare(base: dict, new: dict, threshold: float = 10.0):
+    base, new = flatten(base['results']), flatten(new['results'])
+    regressions = list()
+    for key in sorted(base.keys() & new.keys()):
+        if key.startswith('config.') or key.endswith('.n') or base[key] == 0:
+            continue
+        # abs() keeps the sign of the change for negative values, e.g. saved_us
+        change = (new[key] - base[key]) / abs(base[key]) * 100
+        if key.endswith(HIGHER_IS_BETTER):
+            change = -change
+        flag = ' <-- regression' if change > threshold else ''
+        print(f'{key:60s} {base[key]:12.4f} {new[key]:12.4f} {change:+8.1f}%{flag}')
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent of slowdown reported as regression')
+    args = parser.parse_args()
+    with open(args.base) as fp:
+        base = json.load(fp)
+    with open(args.new) as fp:
+        new = json.load(fp)
+    regressions = compare(base, new, threshold=args.threshold)
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+r"""
+Run the benchmarks offline and save the results as JSON.
+
+    $ python benchmarks/run.py --pools solo threads prefork --concurrency 1 4
+    $ python benchmarks/compare.py benchmarks/results/A.json benchmarks/results/B.json
+"""
+import argparse
+
+import common
+import bench_tasks
+import bench_lifecycle
+import bench_app_context
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', nargs='+', default=['solo', 'threads', 'prefork'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('-n', type=int, default=500, help='tasks per throughput run')
+    parser.add_argument('--work-ms', type=float, default=1.0, help='sleep in the throughput task')
+    parser.add_argument('--overhead-n', type=int, default=20000, help='calls per overhead run, 0 to skip')
+    parser.add_argument('--lifecycle-n', type=int, default=3, help='workers per pool, 0 to skip')
+    parser.add_argument('--prefetch-multiplier', type=int, default=common.PREFETCH_MULTIPLIER)
+    parser.add_argument('--no-instrument', action='store_true', help='create_celery(instrument=False)')
+    parser.add_argument('-o', '--output', default=None, help='JSON output path')
+    args = parser.parse_args()
+    common.PREFETCH_MULTIPLIER = args.prefetch_multiplier
+
+    results = {
+        'config': {
+            'pools': args.pools,
+            'concurrency': args.concurrency,
+            'n': args.n,
+            'work_ms': args.work_ms,
+            'overhead_n': args.overhead_n,
+            'prefetch_multiplier': args.prefetch_multiplier,
+            'instrument': not args.no_instrument,
+        },
+    }
+    results.update(bench_tasks.run(
+        pools=args.pools,
+        concurrencies=args.concurrency,
+        n=args.n,
+        work_ms=args.work_ms,
+        instrument=not args.no_instrument,
+    ))
+    if args.overhead_n > 0:
+        results['overhead'] = bench_app_context.run(n=args.overhead_n)
+    if args.lifecycle_n > 0:
+        results['lifecycle'] = bench_lifecycle.run(pools=args.pools, n=args.lifecycle_n)
+    print(f'Save results to {common.save_results(results, args.output)}')
+
+
+if __name__ == '__main__':
+    main()
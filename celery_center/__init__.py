@@ -1,4 +1,11 @@
 from . import branch
+from . import metrics
+from . import profiler
+from . import resources
+from .resources import WorkerLocal
+from . import routing
+from . import traffic
+from .routing import LoadAwareRouter
 from . import celery_center
 from .celery_center import CeleryCenter
 
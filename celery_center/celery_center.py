@@ -1,35 +1,45 @@
 import os
 import abc
 import sys
+import time
+import threading
 from functools import wraps
-from typing import Callable, Optional, Dict, Any, Type, List, Mapping
+from typing import Callable, Optional, Dict, Any, Type, List, Mapping, Union
 
 from click import Option
 from celery import Celery, Task
 from celery.bootsteps import Step
 from .control.base import WorkspaceBase
+from .routing import LoadAwareRouter
+from .metrics import TimedTaskMixin, registry
+from .traffic import TrafficRecorder
+from .resources import close_worker_locals
 
 
 class TaskCenter:
     def __init__(self,
             func: Callable,
             task_kwargs: Dict[str, Any] = dict(),
+            routable: Union[bool, List[str]] = False,
+            sticky: Optional[Callable] = None,
             ):
         self._func = func
         self._task_kwargs = task_kwargs
+        self._base = task_kwargs.get('base', Task)
         self._bind_func = None
+        self.routable = routable
+        self.sticky = sticky
 
     def add(self,
             celery_instance: Celery,
             task_mixin: Optional[Type] = None
             ):
+        task_kwargs = dict(self._task_kwargs)
         if task_mixin is not None and isinstance(task_mixin, type):
-            base = self._task_kwargs.pop('base', Task)
-            name = 'Binded' + base.__name__
-            binded_base = type(name, (task_mixin, base), dict())
-            self._task_kwargs['base'] = binded_base
+            name = 'Binded' + self._base.__name__
+            task_kwargs['base'] = type(name, (task_mixin, self._base), dict())
 
-        wrapper = celery_instance.task(**self._task_kwargs)
+        wrapper = celery_instance.task(**task_kwargs)
         bind_func = wrapper(self._func)
         self._bind_func = bind_func
         return bind_func
@@ -46,17 +56,28 @@ class TaskCenter:
 
 class AbstractCeleryCenterTask(abc.ABC):
 
-    def __new__(cls, *args, worker_group=None, **task_kwargs):
+    def __new__(cls, *args, worker_group=None, routable=False, sticky=None,
+            **task_kwargs):
         if len(args) > 0:
             func, *args = args
-            obj = cls(*args, **task_kwargs)
+            obj = cls(*args, routable=routable, sticky=sticky, **task_kwargs)
             return obj(func)
         else:
             return super(AbstractCeleryCenterTask, cls).__new__(cls)
 
-    def __init__(self, *args, worker_group=None, **task_kwargs):
+    def __init__(self, *args, worker_group=None, routable=False, sticky=None,
+            **task_kwargs):
+        r"""
+        routable: route by `LoadAwareRouter` if given to `create_celery`.
+            True for the queues of the app (see `LoadAwareRouter`), or a
+            list of eligible queues.
+        sticky: function of the task arguments returning the workspace key,
+            tasks with the same key stick to the same queue.
+        """
         self.args = args
         self.kwargs = task_kwargs
+        self.routable = routable
+        self.sticky = sticky
 
     @property
     @abc.abstractmethod
@@ -64,7 +85,12 @@ class AbstractCeleryCenterTask(abc.ABC):
         raise NotImplementedError
 
     def __call__(self, func):
-        return self.celery_center.add_task(func, self.kwargs)
+        return self.celery_center.add_task(
+            func,
+            self.kwargs,
+            routable=self.routable,
+            sticky=self.sticky,
+        )
 
         
 class CeleryCenter:
@@ -87,11 +113,37 @@ class CeleryCenter:
         for task_center in self._task_center_list:
             task_center.add(celery_instance, task_mixin=task_mixin)
 
-    def add_task(self, func: Callable, kwargs: Dict[str, Any]):
-        task_center = TaskCenter(func, kwargs)
+    def add_task(self,
+            func: Callable,
+            kwargs: Dict[str, Any],
+            routable: Union[bool, List[str]] = False,
+            sticky: Optional[Callable] = None,
+            ):
+        task_center = TaskCenter(func, kwargs, routable=routable, sticky=sticky)
         self._task_center_list.append(task_center)
         return task_center
 
+    def _register_router(self,
+            celery_instance: Celery,
+            router: LoadAwareRouter,
+            ):
+        router.bind(celery_instance)
+        for task_center in self._task_center_list:
+            if not task_center.routable:
+                continue
+            queues = task_center.routable
+            router.add_task(
+                task_center._bind_func.name,
+                queues=None if queues is True else queues,
+                sticky=task_center.sticky,
+            )
+        routes = celery_instance.conf.task_routes
+        if routes is None:
+            routes = ()
+        elif not isinstance(routes, (list, tuple)):
+            routes = (routes,)
+        celery_instance.conf.task_routes = (router, *routes)
+
     def _register_worker_options(self, celery_instance: Celery):
         worker_options = self._user_options.get('worker')
         if worker_options is None or len(worker_options) == 0:
@@ -153,7 +205,14 @@ class CeleryCenter:
         if conf is None or not hasattr(conf, key):
             kwargs.setdefault(key, value)
 
-    def create_celery(self, app=None, **kwargs):
+    def create_celery(self,
+            app=None,
+            router: Optional[LoadAwareRouter] = None,
+            instrument: bool = True,
+            recorder: Optional[TrafficRecorder] = None,
+            app_context: str = 'task',
+            **kwargs
+            ):
         defaults = {
             'worker_pool': 'threads'
         }
@@ -161,6 +220,10 @@ class CeleryCenter:
         change default pool type to `threads` because `prefork` (default) 
         and `processes` cause runtime problem in torch model forward 
         (regardless of device)
+
+        app_context: with flask `app`, 'task' pushes a new app context for
+        every task; 'thread' keeps one app context per pool thread and only
+        runs the teardown functions and resets `g` after each task
         """
         if app is not None:
             defaults['main'] = app.import_name
@@ -172,17 +235,89 @@ class CeleryCenter:
 
         celery_instance = Celery(**kwargs)
 
+        mixins = list()
+        if instrument:
+            mixins.append(TimedTaskMixin)
         if app is not None:
+            if app_context not in ('task', 'thread'):
+                raise ValueError(
+                    f'`app_context` should be \'task\' or \'thread\', got {app_context!r}'
+                )
+            local = threading.local()
+            if app_context == 'thread':
+                # current app context of flask>=2.2
+                from flask.globals import _cv_app
+
             class ContextTaskMixin:
+                def _push_app_context(self):
+                    if app_context == 'task':
+                        ctx = app.app_context()
+                        ctx.push()
+                        return ctx
+                    ctx = getattr(local, 'ctx', None)
+                    if ctx is None:
+                        ctx = local.ctx = app.app_context()
+                        ctx.push()
+                    elif _cv_app.get(None) is not ctx:
+                        # popped or covered by another context in a task
+                        ctx.push()
+                    return ctx
+
+                def _pop_app_context(self, ctx, exc=None):
+                    if app_context == 'task':
+                        ctx.pop(exc)
+                        return
+                    # keep the context for the next task, clean up as pop()
+                    try:
+                        app.do_teardown_appcontext(exc)
+                    finally:
+                        ctx.g = app.app_ctx_globals_class()
+
                 def __call__(self, *args, **kwargs):
-                    with app.app_context():
+                    ctx = self._push_app_context()
+                    exc = None
+                    try:
+                        return self.run(*args, **kwargs)
+                    except BaseException as e:
+                        exc = e
+                        raise
+                    finally:
+                        self._pop_app_context(ctx, exc)
+
+                def _timed_call(self, *args, **kwargs):
+                    t0 = time.perf_counter()
+                    ctx = self._push_app_context()
+                    t1 = time.perf_counter()
+                    exc = None
+                    try:
                         return self.run(*args, **kwargs)
+                    except BaseException as e:
+                        exc = e
+                        raise
+                    finally:
+                        t2 = time.perf_counter()
+                        self._pop_app_context(ctx, exc)
+                        t3 = time.perf_counter()
+                        registry.observe(self.name, 'run', t2 - t1)
+                        registry.observe(self.name, 'app_context', t1 - t0 + t3 - t2)
 
             celery_instance.conf.update(app.config)
-            task_mixin = ContextTaskMixin
-        else:
+            mixins.append(ContextTaskMixin)
+
+        if len(mixins) == 0:
             task_mixin = None
+        elif len(mixins) == 1:
+            task_mixin = mixins[0]
+        else:
+            task_mixin = type('CeleryCenterTaskMixin', tuple(mixins), dict())
         self._register_tasks(celery_instance, task_mixin=task_mixin)
+        if router is not None:
+            self._register_router(celery_instance, router)
+        if recorder is not None:
+            recorder.bind(
+                celery_instance,
+                [tc._bind_func.name for tc in self._task_center_list]
+            )
         self._register_worker_options(celery_instance)
         return celery_instance
 
@@ -195,3 +330,4 @@ class CeleryCenter:
                 task_base = task_bases[0]
                 if getattr(task_base, 'workspace', None) is not None:
                     task_base.workspace.terminate()
+            close_worker_locals()
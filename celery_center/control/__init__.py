@@ -1,4 +1,5 @@
 from . import utils
 from . import base
+from . import load
 from . import worker_control_center
 from .worker_control_center import WorkerControlCenter
@@ -0,0 +1,97 @@
+import time
+from typing import Optional, Dict, Any
+
+from celery import Celery
+from celery.app.control import Inspect
+
+
+def queue_depth(app: Celery, queue: str) -> Optional[int]:
+    r"""
+    Number of messages waiting in the broker for `queue`, None if the
+    transport cannot tell.
+    """
+    try:
+        with app.connection_for_write() as conn:
+            _, count, _ = conn.default_channel.queue_declare(
+                queue=queue, passive=True)
+            return count
+    except Exception:
+        return None
+
+
+class QueueLoadSampler:
+    r"""
+    Estimate the load of each queue from the live state of the workers.
+
+    backlog: messages in the broker + reserved + active tasks
+    capacity: sum of pool sizes of the workers consuming the queue
+    throughput: finished tasks per second since the previous sample
+    wait: estimated seconds until a new task starts
+    """
+    def __init__(self, min_interval: float = 1.0):
+        self.min_interval = min_interval
+        self._prev = dict()
+
+    def _throughput(self, hostname: str, total: int, now: float):
+        prev = self._prev.get(hostname)
+        if prev is None or now - prev[1] < self.min_interval:
+            if prev is None:
+                self._prev[hostname] = (total, now)
+            return None
+        prev_total, prev_time = prev
+        self._prev[hostname] = (total, now)
+        return max(total - prev_total, 0) / (now - prev_time)
+
+    def sample(self,
+            inspect: Inspect,
+            app: Optional[Celery] = None,
+            ) -> Dict[str, Any]:
+        now = time.monotonic()
+        active_queues = inspect.active_queues() or dict()
+        active = inspect.active() or dict()
+        reserved = inspect.reserved() or dict()
+        stats = inspect.stats() or dict()
+
+        workers = dict()
+        for hostname, qlist in active_queues.items():
+            st = stats.get(hostname, dict())
+            capacity = st.get('pool', dict()).get('max-concurrency', 1)
+            total = sum(st.get('total', dict()).values())
+            workers[hostname] = {
+                'queues': [q['name'] for q in qlist],
+                'active': len(active.get(hostname) or list()),
+                'reserved': len(reserved.get(hostname) or list()),
+                'capacity': capacity,
+                'throughput': self._throughput(hostname, total, now),
+            }
+
+        queues = dict()
+        for hostname, w in workers.items():
+            for name in w['queues']:
+                q = queues.setdefault(name, {
+                    'workers': list(),
+                    'backlog': 0,
+                    'capacity': 0,
+                    'throughput': 0.0,
+                })
+                n = len(w['queues'])
+                q['workers'].append(hostname)
+                # a worker consuming several queues shares its slots
+                q['backlog'] += (w['active'] + w['reserved']) / n
+                q['capacity'] += w['capacity'] / n
+                if q['throughput'] is not None and w['throughput'] is not None:
+                    q['throughput'] += w['throughput'] / n
+                else:
+                    q['throughput'] = None
+
+        for name, q in queues.items():
+            if app is not None:
+                q['backlog'] += queue_depth(app, name) or 0
+            if q['backlog'] < q['capacity']:
+                q['wait'] = 0.0
+            elif q['throughput']:
+                q['wait'] = (q['backlog'] + 1 - q['capacity']) / q['throughput']
+            else:
+                q['wait'] = None
+
+        return {'time': time.time(), 'queues': queues, 'workers': workers}
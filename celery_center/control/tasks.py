@@ -1,19 +1,30 @@
+import time
 import marshal
 import base64
+import hashlib
 
-from typing import Callable, Any
+from typing import Callable, Any, List, Iterable
 from types import FunctionType
 from functools import wraps
+from collections import OrderedDict
 from celery import Task
 from celery.app.control import Inspect
 
 from ..celery_center import CeleryCenter
 from .worker_control_center import WorkerControlCenter
 from .base import WorkspaceBase
+from .utils import SharedInspect
 
 
 celery_center = CeleryCenter()
 
+MAX_INSPECT_FUNCTIONS = 256
+# control worker side: digest -> function / (time, result)
+_inspect_functions = OrderedDict()
+_inspect_results = dict()
+# client side: digests registered to the control worker
+_registered_digests = set()
+
 
 class WorkerControlTask(Task):
     workspace = None
@@ -26,10 +37,51 @@ def force_sync(func):
     return wrapper
 
 
-def inspect(func: Callable[[Inspect], Any]):
+def _encode_code(func: Callable[[Inspect], Any]):
     codebytes = marshal.dumps(func.__code__)
-    codestr = base64.b64encode(codebytes).decode()
-    return _inspect.delay(codestr).wait()
+    digest = hashlib.sha256(codebytes).hexdigest()
+    return digest, base64.b64encode(codebytes).decode()
+
+
+def register_inspect(func: Callable[[Inspect], Any]) -> str:
+    r"""
+    Send the code of `func` to the control worker once, return its digest.
+    """
+    digest = getattr(func, '__inspect_digest__', None)
+    if digest is None or digest not in _registered_digests:
+        digest, codestr = _encode_code(func)
+        _register_inspect.delay(codestr).wait()
+        _registered_digests.add(digest)
+        try:
+            func.__inspect_digest__ = digest
+        except AttributeError:
+            pass
+    return digest
+
+
+def inspect_many(funcs: Iterable[Callable[[Inspect], Any]], ttl: float = 0) -> List[Any]:
+    r"""
+    Run several inspect functions in one request. The functions share the
+    broadcasts of the same `Inspect` calls, and results younger than `ttl`
+    seconds are reused by the control worker.
+    """
+    funcs = list(funcs)
+    digests = [register_inspect(f) for f in funcs]
+    res = _inspect_digests.delay(digests, ttl=ttl).wait()
+    if len(res['missing']) > 0:
+        # the control worker was restarted, register again
+        for digest in res['missing']:
+            _registered_digests.discard(digest)
+        digests = [register_inspect(f) for f in funcs]
+        res = _inspect_digests.delay(digests, ttl=ttl).wait()
+        if len(res['missing']) > 0:
+            raise RuntimeError(
+                f'inspect functions not registered to the control worker: {res["missing"]}')
+    return res['results']
+
+
+def inspect(func: Callable[[Inspect], Any], ttl: float = 0):
+    return inspect_many([func], ttl=ttl)[0]
 
 
 @force_sync
@@ -45,6 +97,85 @@ def _inspect(task, codestr):
     return func(task.workspace.inspect)
 
 
+@celery_center.task(base=WorkerControlTask, bind=True, name='control._register_inspect')
+def _register_inspect(task, codestr):
+    codebytes = base64.b64decode(codestr.encode())
+    digest = hashlib.sha256(codebytes).hexdigest()
+    if digest in _inspect_functions:
+        _inspect_functions.move_to_end(digest)
+        return digest
+    _inspect_functions[digest] = FunctionType(marshal.loads(codebytes), globals())
+    while len(_inspect_functions) > MAX_INSPECT_FUNCTIONS:
+        old, _ = _inspect_functions.popitem(last=False)
+        _inspect_results.pop(old, None)
+    return digest
+
+
+@celery_center.task(base=WorkerControlTask, bind=True, name='control._inspect_digests')
+def _inspect_digests(task, digests, ttl=0):
+    missing = [d for d in digests if d not in _inspect_functions]
+    if len(missing) > 0:
+        return {'results': None, 'missing': missing}
+    shared = None
+    results = list()
+    now = time.monotonic()
+    for digest in digests:
+        _inspect_functions.move_to_end(digest)
+        cached = _inspect_results.get(digest)
+        if cached is not None and now - cached[0] < ttl:
+            results.append(cached[1])
+            continue
+        if shared is None:
+            shared = SharedInspect(task.workspace.inspect)
+        res = _inspect_functions[digest](shared)
+        _inspect_results[digest] = (now, res)
+        results.append(res)
+    return {'results': results, 'missing': list()}
+
+
+def profile(
+        node: str,
+        seconds: float = 5.0,
+        interval: float = 0.01,
+        top: int = 20,
+        timeout: float = 30.0,
+        ):
+    r"""
+    Sample the stacks of worker `node` for `seconds`. The client waits, the
+    control worker only starts the session and answers the polls.
+
+    A worker busy with a task may not reply to a poll (e.g. the solo pool),
+    which counts as not done yet; None is returned if the session is not
+    started or done `timeout` seconds after the sampling ends.
+    """
+    deadline = time.monotonic() + seconds + timeout
+    session_id = None
+    while session_id is None:
+        session_id = _profile_start.delay(node, seconds=seconds, interval=interval).wait()
+        if session_id is None:
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.2)
+    time.sleep(seconds)
+    while True:
+        res = _profile_result.delay(node, session_id, top=top).wait()
+        if res is not None and res.get('done', True):
+            return res
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(0.2)
+
+
+@celery_center.task(base=WorkerControlTask, bind=True, name='control._profile_start')
+def _profile_start(task, node, seconds=5.0, interval=0.01):
+    return task.workspace.profile(node, seconds=seconds, interval=interval)
+
+
+@celery_center.task(base=WorkerControlTask, bind=True, name='control._profile_result')
+def _profile_result(task, node, session_id, top=20):
+    return task.workspace.profile_result(node, session_id, top=top)
+
+
 @force_sync
 @celery_center.task(base=WorkerControlTask, bind=True, name='control.active_queue_names')
 def active_queue_names(task):
@@ -54,6 +185,18 @@ def active_queue_names(task):
     return list({q['name'] for qlist in aq.values() for q in qlist})
 
 
+@force_sync
+@celery_center.task(base=WorkerControlTask, bind=True, name='control.load')
+def load(task):
+    return task.workspace.load()
+
+
+@force_sync
+@celery_center.task(base=WorkerControlTask, bind=True, name='control.metrics')
+def metrics(task, nodes=None, reset=False):
+    return task.workspace.metrics(nodes, reset=reset)
+
+
 @celery_center.task(base=WorkerControlTask, bind=True, name='control.create_worker')
 def create_worker(task, node, kwargs=dict()):
     return task.workspace.start_worker(node, kwargs, wait_for_ready=True)
@@ -67,6 +67,60 @@ def parse_json_config(path: str) -> Union[None, Tuple[dict, dict]]:
 
 
 def save_json_config(path: str, config: dict(), global_config: dict = dict()):
+    r"""
+    Write to a temporary file next to `path` and rename it, so readers never
+    see a partially written config.
+
+    Values equal to the ones in `global_config` are not written, the
+    inverse of `parse_json_config`, so that later edits of `global` still
+    apply to every entry.
+    """
+    config = {
+        kc: {
+            k: {
+                ck: v for ck, v in c.items()
+                if ck not in global_config.get(kc, dict())
+                or global_config[kc][ck] != v
+            } for k, c in cfg.items()
+        } for kc, cfg in config.items()
+    }
     config = {'global': global_config, **config}
-    with open(path, 'w') as fp:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as fp:
         json.dump(config, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+def get_mtime(path: str) -> Union[None, int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SharedInspect:
+    r"""
+    Proxy of `Inspect` which broadcasts each method call (with the same
+    arguments) only once, so several inspect functions can share it.
+    """
+    def __init__(self, inspect):
+        self._inspect = inspect
+        self._replies = dict()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._inspect, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            try:
+                key = (name, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                return attr(*args, **kwargs)
+            if key not in self._replies:
+                self._replies[key] = attr(*args, **kwargs)
+            return self._replies[key]
+        return method
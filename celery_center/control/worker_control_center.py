@@ -1,5 +1,7 @@
+import os
 import time
 import json
+import threading
 from pprint import pprint
 from typing import Optional, Union, Callable, Dict, List, Any, Type, Tuple, Iterable, Mapping
 from collections import OrderedDict
@@ -9,11 +11,21 @@ from celery.app.utils import find_app
 from celery.app.control import Control, Inspect
 
 from celery_center.branch.subprocess import SubprocessBranch
+from celery_center.branch.threading import ThreadingBranch
+from celery_center.metrics import merge_snapshots, start_http_server
 from .base import WorkspaceBase
-from .utils import get_worker_cmd, get_hostname
+from .load import QueueLoadSampler
+from .utils import get_worker_cmd, get_hostname, get_mtime
 from .utils import parse_json_config, save_json_config
 
 
+def _normalize_run_config(run_config: Mapping[str, Any]) -> Dict[str, Any]:
+    cfg = {k: v for k, v in run_config.items() if k != 'hostname'}
+    if cfg.get('queues') is not None:
+        cfg['queues'] = sorted(set(cfg['queues']))
+    return cfg
+
+
 class WorkerProcess:
 
     def __init__(self,
@@ -27,6 +39,7 @@ class WorkerProcess:
         self.hostname = get_hostname(hostname)
         self.host, self.node = self.hostname.split('@')
         self.quiet = quiet
+        self.run_config = dict(run_config)
         self.cmd, self.config = get_worker_cmd(
             self.hostname,
             quiet=quiet,
@@ -72,6 +85,32 @@ class WorkerProcess:
         }
         return info
 
+    def update_queues(self, queues: List[str]):
+        r"""
+        Change consumed queues of the running worker without restarting it.
+        """
+        current = self.run_config.get('queues')
+        if not current:
+            # started without --queues, the worker consumes the default queue
+            current = [self.app.conf.task_default_queue]
+        for queue in queues:
+            if queue not in current:
+                self.app.control.add_consumer(
+                    queue, destination=[self.hostname], reply=True)
+        for queue in current:
+            if queue not in queues:
+                self.app.control.cancel_consumer(
+                    queue, destination=[self.hostname], reply=True)
+        self.run_config['queues'] = list(queues)
+        self.cmd, self.config = get_worker_cmd(
+            self.hostname,
+            quiet=self.quiet,
+            **self.run_config
+        )
+
+    def terminate(self):
+        self._p.terminate()
+
     def shutdown(self, join: bool = False, timeout: Optional[int] = None):
         if not self.is_running:
             return
@@ -106,15 +145,41 @@ class WorkerControlCenter(WorkspaceBase):
                 type=str,
                 help='path of config file'
             ),
+            Option(
+                ('--watch-cfg', 'watch_cfg'),
+                default=defaults.get('watch_cfg', False),
+                is_flag=True,
+                help='reconcile workers when the config file changes'
+            ),
+            Option(
+                ('--watch-interval', 'watch_interval'),
+                default=defaults.get('watch_interval', 2.0),
+                type=float,
+                show_default=True,
+                help='seconds between config file checks'
+            ),
+            Option(
+                ('--metrics-port', 'metrics_port'),
+                default=defaults.get('metrics_port', None),
+                type=int,
+                help='serve task metrics of all workers in prometheus format'
+            ),
         ]
         return options
 
     @classmethod
     def register_workspace(cls, **kwargs) -> object:
         app_name = kwargs.pop('app_name', None)
+        watch_cfg = kwargs.pop('watch_cfg', False)
+        watch_interval = kwargs.pop('watch_interval', 2.0)
+        metrics_port = kwargs.pop('metrics_port', None)
         if app_name is not None:
             wcc = cls(app_name, **kwargs)
             wcc.start()
+            if watch_cfg:
+                wcc.watch(interval=watch_interval)
+            if metrics_port is not None:
+                wcc.serve_metrics(metrics_port)
             return wcc
         else:
             return None
@@ -126,14 +191,17 @@ class WorkerControlCenter(WorkspaceBase):
             **kwargs,
             ):
         r"""
-        cfg_path: None -> no state saved; otherwise -> save state when terminated, read state when started if json file is not empty
+        cfg_path: None -> no state saved; otherwise -> save state whenever workers change, read state when started if json file is not empty
         init_cfg: use when config read from cfg_path is empty
         """
         self.cfg_path = cfg_path
         self.cfg = {'workers': dict()}
-        
+        self.init_cfg_path = None
+        global_cfg = dict()
+
         if init_cfg is not None:
             if isinstance(init_cfg, str):
+                self.init_cfg_path = init_cfg
                 cfgs = parse_json_config(init_cfg)
                 if cfgs is not None:
                     global_cfg, init_cfg =  cfgs
@@ -147,6 +215,8 @@ class WorkerControlCenter(WorkspaceBase):
                 TypeError(
                     f'Input argument `init_cfg` should be a path or a dict()'
                 )
+        else:
+            init_cfg = dict()
 
         if cfg_path is not None:
             cfgs = parse_json_config(cfg_path)
@@ -156,15 +226,24 @@ class WorkerControlCenter(WorkspaceBase):
                 ValueError(
                     f'object in `cfg_path` should be a dict().'
                 )
-        pprint(init_cfg['workers'])
 
         self.global_cfg, self.init_cfg = global_cfg, init_cfg
         self.global_cfg.setdefault('workers', dict())
         self.init_cfg.setdefault('workers', dict())
+        pprint(self.init_cfg['workers'])
         self.cfg_path = cfg_path
         self.app_name = app_name
         self.app = find_app(app_name)
         self._wpdict = OrderedDict()
+        self._lock = threading.RLock()
+        self._cfg_mtime = None
+        self._watcher = None
+        self._watching = threading.Event()
+        self._unwatched = threading.Event()
+        self._reload_lock = threading.Lock()
+        self._load_sampler = QueueLoadSampler()
+        self._metrics_server = None
+        self._metrics_warned = set()
 
     @property
     def nodes(self):
@@ -204,21 +283,31 @@ class WorkerControlCenter(WorkspaceBase):
     def start_worker(self,
             node: str,
             run_config: Mapping[str, Any],
-            wait_for_ready: bool = True
+            wait_for_ready: bool = True,
+            persist: bool = True,
             ) -> str:
         node = get_hostname(node)
-        if node in self._wpdict:
-            print(f'hostname `{node}` duplicated')
-            return 
-        run_config['hostname'] = node
-        wp = WorkerProcess(self.app_name, **run_config)
-        wp.start()
-        self._wpdict[node] = wp
-        self.cfg['workers'][node] = run_config
+        if persist:
+            self._sync_config()
+        with self._lock:
+            if node in self._wpdict:
+                print(f'hostname `{node}` duplicated')
+                return 
+            run_config['hostname'] = node
+            wp = WorkerProcess(self.app_name, **run_config)
+            wp.start()
+            self._wpdict[node] = wp
+            if persist:
+                self.cfg['workers'][node] = run_config
+                self.save_config()
         if wait_for_ready:
             if not wp.wait_for_ready():
                 wp.shutdown()
-                del self._wpdict[node]
+                with self._lock:
+                    self._wpdict.pop(node, None)
+                    if persist:
+                        self.cfg['workers'].pop(node, None)
+                        self.save_config()
                 return None
         return node
 
@@ -235,15 +324,118 @@ class WorkerControlCenter(WorkspaceBase):
             ):
         return self._overload(nodes=nodes, func=lambda wp: wp.info())
 
+    def load(self) -> Dict[str, Any]:
+        return self._load_sampler.sample(self.inspect, self.app)
+
+    def metrics(self,
+            nodes: Optional[Union[str, Iterable[str]]] = None,
+            reset: bool = False,
+            timeout: float = 1.0,
+            ) -> Dict[str, Any]:
+        r"""
+        Collect the task phase histograms of the workers. Workers of the
+        prefork pool reply only the main process, which runs no task; they
+        are listed in `prefork`.
+        return: {'workers': {hostname: snapshot}, 'total': merged snapshot,
+            'prefork': [hostname]}
+        """
+        nodes = self._get_nodes(nodes)
+        if len(nodes) == 0:
+            return {'workers': dict(), 'total': dict(), 'prefork': list()}
+        prefork = [
+            node for node in nodes
+            if self._wpdict[node].config.get('pool') == 'prefork'
+        ]
+        unwarned = [node for node in prefork if node not in self._metrics_warned]
+        if len(unwarned) > 0:
+            self._metrics_warned.update(unwarned)
+            print(f'Task metrics of prefork workers are not collected: {unwarned}')
+        replies = self.control.broadcast(
+            'cc_metrics',
+            arguments={'reset': reset},
+            destination=nodes,
+            reply=True,
+            timeout=timeout,
+        )
+        workers = {h: s for r in replies for h, s in r.items()}
+        return {
+            'workers': workers,
+            'total': merge_snapshots(workers.values()),
+            'prefork': prefork,
+        }
+
+    def profile(self,
+            node: str,
+            seconds: float = 5.0,
+            interval: float = 0.01,
+            timeout: float = 1.0,
+            ) -> Optional[str]:
+        r"""
+        Start sampling the stacks of all threads of worker `node` for
+        `seconds` and return the session id without waiting, poll the
+        result with `profile_result`. The sampler runs in a thread of the
+        main process of the worker, so with the prefork pool the tasks
+        running in the child processes are not sampled.
+        """
+        hostname = get_hostname(node)
+        replies = self.control.broadcast(
+            'cc_profile_start',
+            arguments={'seconds': seconds, 'interval': interval},
+            destination=[hostname],
+            reply=True,
+            timeout=timeout,
+        )
+        if len(replies) == 0:
+            return None
+        return replies[0][hostname]['id']
+
+    def profile_result(self,
+            node: str,
+            session_id: str,
+            top: int = 20,
+            timeout: float = 1.0,
+            ) -> Optional[Dict[str, Any]]:
+        r"""
+        return: `done`, collapsed stacks for flamegraph and top `top`
+            functions by self and cumulative samples
+        """
+        hostname = get_hostname(node)
+        replies = self.control.broadcast(
+            'cc_profile_result',
+            arguments={'id': session_id, 'top': top},
+            destination=[hostname],
+            reply=True,
+            timeout=timeout,
+        )
+        if len(replies) == 0:
+            return None
+        return replies[0][hostname]
+
+    def serve_metrics(self, port: int, addr: str = '0.0.0.0'):
+        if self._metrics_server is not None:
+            return
+        self._metrics_server, _ = start_http_server(
+            port,
+            lambda: self.metrics()['workers'],
+            addr=addr,
+        )
+
     def stop_workers(self,
             nodes: Optional[Union[str, Iterable[str]]] = None,
             join: bool = True,
-            timeout: Optional[int] = None
+            timeout: Optional[int] = None,
+            persist: bool = True,
             ):
-        nodes = self._get_nodes(nodes=nodes)
-        for node in nodes:
-            self._wpdict[node].shutdown(join=False)
-            self.cfg['workers'].pop(node, None)
+        if persist:
+            self._sync_config()
+        with self._lock:
+            nodes = self._get_nodes(nodes=nodes)
+            for node in nodes:
+                self._wpdict[node].shutdown(join=False)
+                if persist:
+                    self.cfg['workers'].pop(node, None)
+            if persist:
+                self.save_config()
         if join:
             self.join(nodes, timeout=timeout)
 
@@ -254,11 +446,200 @@ class WorkerControlCenter(WorkspaceBase):
         nodes = self._get_nodes(nodes=nodes)
         for node in nodes:
             self._wpdict[node].join(timeout=timeout)
-            del self._wpdict[node]
+            with self._lock:
+                self._wpdict.pop(node, None)
+
+    def _config_changed(self) -> bool:
+        r"""
+        Whether the watched `cfg_path` was edited since it was read or saved.
+        """
+        if self.cfg_path is None or not self._watching.is_set():
+            return False
+        if self._cfg_mtime is None:
+            return False
+        return get_mtime(self.cfg_path) != self._cfg_mtime
+
+    def _sync_config(self):
+        r"""
+        Apply a pending edit of the watched config before changing workers,
+        otherwise the next save would overwrite it.
+        """
+        if self._config_changed():
+            self._reload(self.cfg_path)
+
+    def save_config(self):
+        if self.cfg_path is None:
+            return
+        with self._lock:
+            if self._config_changed():
+                print(f'Config `{self.cfg_path}` changed since it was read, not saved')
+                return
+            save_json_config(
+                self.cfg_path,
+                self.cfg,
+                global_config=self.global_cfg
+            )
+            self._cfg_mtime = get_mtime(self.cfg_path)
+
+    def _join_or_terminate(self, nodes: List[str], timeout: float):
+        for node in nodes:
+            wp = self._wpdict.get(node)
+            if wp is None:
+                continue
+            try:
+                wp.join(timeout=timeout)
+            except Exception:
+                pass
+            if wp.is_running:
+                print(f'Worker `{node}` did not stop in {timeout}s, terminate it')
+                wp.terminate()
+                try:
+                    wp.join(timeout=timeout)
+                except Exception:
+                    pass
+            with self._lock:
+                self._wpdict.pop(node, None)
+
+    def reconcile(self,
+            cfg: Mapping[str, Any],
+            wait_for_ready: bool = True,
+            timeout: float = 30.0,
+            ) -> Dict[str, List[str]]:
+        r"""
+        Bring running workers in line with `cfg['workers']`.
+
+        Only workers whose config changed are touched: new nodes are started,
+        missing nodes are stopped, nodes differing only in `queues` are
+        reconfigured with `add_consumer`/`cancel_consumer` and other changes
+        restart the node. Workers not stopped in `timeout` seconds are
+        terminated. The config is saved once at the end, nodes which failed
+        to start are kept in it.
+        """
+        desired = {
+            get_hostname(node): dict(run_config)
+            for node, run_config in cfg.get('workers', dict()).items()
+        }
+        result = {
+            'started': list(),
+            'stopped': list(),
+            'restarted': list(),
+            'requeued': list(),
+            'failed': list(),
+        }
+        with self._lock:
+            removed = [n for n in self._wpdict if n not in desired]
+            if len(removed) > 0:
+                self.stop_workers(removed, join=False, persist=False)
+                result['stopped'] = removed
+
+            for node, run_config in desired.items():
+                wp = self._wpdict.get(node)
+                if wp is None:
+                    continue
+                old = _normalize_run_config(
+                    {**wp.run_config, 'quiet': wp.quiet})
+                new = _normalize_run_config({'quiet': True, **run_config})
+                if old == new:
+                    continue
+                old.pop('queues', None)
+                queues = new.pop('queues', None)
+                if old == new and queues is not None and wp.is_running:
+                    wp.update_queues(run_config['queues'])
+                    result['requeued'].append(node)
+                else:
+                    self.stop_workers(node, join=False, persist=False)
+                    result['restarted'].append(node)
+
+        # wait outside of the lock, start_worker() of the same hostname
+        # must not overlap with the old process
+        self._join_or_terminate(result['stopped'] + result['restarted'], timeout)
+        for node, run_config in desired.items():
+            if node in self._wpdict:
+                continue
+            if self.start_worker(node, dict(run_config),
+                    wait_for_ready=wait_for_ready, persist=False):
+                if node not in result['restarted']:
+                    result['started'].append(node)
+            else:
+                result['failed'].append(node)
+                if node in result['restarted']:
+                    result['restarted'].remove(node)
+
+        with self._lock:
+            self.cfg['workers'] = {
+                node: {**run_config, 'hostname': node}
+                for node, run_config in desired.items()
+            }
+            self.save_config()
+        return result
+
+    def _watch_path(self) -> Optional[str]:
+        return self.cfg_path or self.init_cfg_path
+
+    def watch(self, interval: float = 2.0):
+        path = self._watch_path()
+        if path is None:
+            print('No config file to watch')
+            return
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        if self._cfg_mtime is None:
+            self._cfg_mtime = get_mtime(path)
+        self._watching.set()
+        self._unwatched.clear()
+        self._watcher = ThreadingBranch(
+            target=self._watch_loop,
+            args=(path, interval),
+            kwargs=dict(),
+            daemon=True,
+        )
+        self._watcher.start()
+
+    def unwatch(self, timeout: float = 5.0):
+        r"""
+        timeout: seconds to wait for a running reload to finish
+        """
+        self._watching.clear()
+        self._unwatched.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=timeout)
+            if self._watcher.is_alive():
+                print(f'Config watcher did not stop in {timeout}s')
+            self._watcher = None
+
+    def _reload(self, path: str) -> Optional[Dict[str, List[str]]]:
+        r"""
+        Reconcile with `path` if it changed since it was read or saved.
+        """
+        with self._reload_lock:
+            return self._reload_locked(path)
+
+    def _reload_locked(self, path: str) -> Optional[Dict[str, List[str]]]:
+        mtime = get_mtime(path)
+        if mtime is None or mtime == self._cfg_mtime:
+            return None
+        self._cfg_mtime = mtime
+        try:
+            cfgs = parse_json_config(path)
+        except Exception as e:
+            print(f'Fail to read config `{path}`: {e}')
+            return None
+        if cfgs is None:
+            return None
+        global_cfg, cfg = cfgs
+        self.global_cfg = global_cfg
+        self.global_cfg.setdefault('workers', dict())
+        print(f'Reconcile workers with `{path}`')
+        result = self.reconcile(cfg, wait_for_ready=False)
+        pprint(result)
+        return result
+
+    def _watch_loop(self, path: str, interval: float):
+        while not self._unwatched.wait(interval):
+            self._reload(path)
 
     def start(self, eventloop: bool = False):
-        for node, run_config in self.init_cfg['workers'].items():
-            self.start_worker(node, run_config, wait_for_ready=False)
+        self.reconcile(self.init_cfg, wait_for_ready=False)
         if eventloop:
             try:
                 pmain = ThreadingBranch(target=self._main_eventloop)
@@ -268,15 +649,15 @@ class WorkerControlCenter(WorkspaceBase):
                 self.terminate()
 
     def terminate(self, timeout: Optional[int] = None):
+        self.unwatch()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server = None
         # save config
         if self.cfg_path is not None:
             print('Save config')
-            save_json_config(
-                self.cfg_path,
-                self.cfg,
-                global_config=self.global_cfg
-            )
-        self.stop_workers(timeout=timeout)
+            self.save_config()
+        self.stop_workers(timeout=timeout, persist=False)
 
     def _main_eventloop(self):
         try:
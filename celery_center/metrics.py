@@ -0,0 +1,259 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Any, Iterable, Mapping, Tuple
+
+from celery.worker.control import inspect_command
+
+from .branch.threading import ThreadingBranch
+
+
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'),
+)
+SENT_HEADER = 'cc_sent'
+
+
+class Histogram:
+    r"""
+    Fixed bucket histogram. `counts[i]` is the number of observations in
+    (buckets[i-1], buckets[i]] (not cumulative).
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Iterable[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'buckets': list(self.buckets[:-1]),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class MetricsRegistry:
+    r"""
+    Per process histograms of task phases, keyed by task name and phase:
+
+    queue_wait: publish to start of execution (needs synchronized clocks)
+    app_context: push and pop of the Flask app context
+    run: the task body
+    result: result serialization and backend store
+    """
+    def __init__(self, buckets: Iterable[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self._hists = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, task_name: str, phase: str, seconds: float):
+        key = (task_name, phase)
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, task_name: str, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(task_name, phase, time.perf_counter() - start)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        res = dict()
+        with self._lock:
+            for (task_name, phase), hist in self._hists.items():
+                res.setdefault(task_name, dict())[phase] = hist.to_dict()
+            if reset:
+                self._hists.clear()
+        return res
+
+
+registry = MetricsRegistry()
+_local = threading.local()
+
+
+def timer(task_name: str, phase: str):
+    r"""
+    Time a custom phase inside a task, e.g. workspace access
+    ```
+    with metrics.timer(task.name, 'workspace'):
+        model = task.workspace.get_model()
+    ```
+    """
+    return registry.timer(task_name, phase)
+
+
+def observe_queue_wait(task):
+    sent = getattr(task.request, SENT_HEADER, None)
+    if sent is None:
+        sent = (task.request.headers or dict()).get(SENT_HEADER)
+    if sent is not None:
+        registry.observe(task.name, 'queue_wait', max(time.time() - sent, 0.0))
+
+
+def mark_returned():
+    _local.returned = time.perf_counter()
+
+
+class TimedTaskMixin:
+    r"""
+    Record the phases of each task into `registry`. A mixin placed after this
+    one in the MRO may implement `_timed_call` to wrap the task body itself.
+    """
+    def apply_async(self, *args, **options):
+        headers = options.get('headers')
+        options['headers'] = {
+            **(headers or dict()),
+            SENT_HEADER: time.time()
+        }
+        return super().apply_async(*args, **options)
+
+    def __call__(self, *args, **kwargs):
+        observe_queue_wait(self)
+        try:
+            call = getattr(super(), '_timed_call', None)
+            if call is not None:
+                return call(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return self.run(*args, **kwargs)
+            finally:
+                registry.observe(self.name, 'run', time.perf_counter() - start)
+        finally:
+            mark_returned()
+
+    def on_success(self, retval, task_id, args, kwargs):
+        # the tracer stores the result between __call__ and on_success
+        returned = getattr(_local, 'returned', None)
+        if returned is not None:
+            registry.observe(self.name, 'result', time.perf_counter() - returned)
+            _local.returned = None
+        return super().on_success(retval, task_id, args, kwargs)
+
+
+def merge_snapshots(
+        snapshots: Iterable[Mapping[str, Mapping[str, Mapping[str, Any]]]]
+        ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    res = dict()
+    for snapshot in snapshots:
+        for task_name, phases in snapshot.items():
+            for phase, hist in phases.items():
+                acc = res.setdefault(task_name, dict()).get(phase)
+                if acc is None:
+                    res[task_name][phase] = {
+                        **hist, 'counts': list(hist['counts'])}
+                    continue
+                acc['counts'] = [a + b for a, b in zip(acc['counts'], hist['counts'])]
+                acc['sum'] += hist['sum']
+                acc['count'] += hist['count']
+    return res
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(
+        snapshots: Mapping[str, Mapping[str, Mapping[str, Mapping[str, Any]]]],
+        name: str = 'celery_center_task_phase_seconds',
+        ) -> str:
+    r"""
+    Prometheus text exposition of `{worker: snapshot}`.
+    """
+    lines = [
+        f'# HELP {name} Time spent in each phase of a task.',
+        f'# TYPE {name} histogram',
+    ]
+    for worker, snapshot in snapshots.items():
+        for task_name, phases in snapshot.items():
+            for phase, hist in phases.items():
+                labels = (
+                    f'worker="{_escape(worker)}",'
+                    f'task="{_escape(task_name)}",'
+                    f'phase="{_escape(phase)}"'
+                )
+                cum = 0
+                for le, count in zip([*hist['buckets'], '+Inf'], hist['counts']):
+                    cum += count
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cum}')
+                lines.append(f'{name}_sum{{{labels}}} {hist["sum"]}')
+                lines.append(f'{name}_count{{{labels}}} {hist["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+_warned_prefork = False
+
+
+def is_prefork(pool) -> bool:
+    return type(pool).__module__ == 'celery.concurrency.prefork'
+
+
+@inspect_command()
+def cc_metrics(state, reset: bool = False):
+    r"""
+    Task phase histograms of this worker.
+
+    Control commands run in the main process of the worker, so with the
+    prefork pool the histograms recorded in the child processes are not
+    collected; use the threads or solo pool to collect them.
+    """
+    global _warned_prefork
+    if is_prefork(state.consumer.pool) and not _warned_prefork:
+        _warned_prefork = True
+        print('Task metrics are recorded in the prefork children and not collected, '
+              'use the threads or solo pool')
+    return registry.snapshot(reset=reset)
+
+
+def start_http_server(
+        port: int,
+        collect: Callable[[], Mapping[str, Any]],
+        addr: str = '0.0.0.0',
+        ) -> Tuple[ThreadingHTTPServer, ThreadingBranch]:
+    r"""
+    Serve `to_prometheus(collect())` at `/metrics` in a daemon thread.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            try:
+                body = to_prometheus(collect()).encode()
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    th = ThreadingBranch(
+        target=server.serve_forever,
+        args=(),
+        kwargs=dict(),
+        daemon=True
+    )
+    th.start()
+    return server, th
@@ -0,0 +1,188 @@
+import sys
+import time
+import uuid
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional, Dict, List, Any, Tuple
+
+from celery.worker.control import control_command, inspect_command
+
+from .branch.threading import ThreadingBranch
+
+
+MAX_SECONDS = 300
+MAX_SESSIONS = 4
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+    return name.replace(';', ':')
+
+
+class StackSampler:
+    r"""
+    Sample the stacks of all threads of this process with
+    `sys._current_frames()` in a daemon thread.
+
+    The sampler sleeps long enough to keep its own cost below
+    `max_overhead` of the wall time, and stops collecting new distinct
+    stacks after `max_stacks`.
+    """
+    def __init__(self,
+            seconds: float = 5.0,
+            interval: float = 0.01,
+            max_depth: int = 64,
+            max_stacks: int = 10000,
+            max_overhead: float = 0.05,
+            ):
+        self.seconds = min(seconds, MAX_SECONDS)
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.max_overhead = max_overhead
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._th = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._th is not None and self._th.is_alive()
+
+    def start(self):
+        self.started = time.time()
+        self._th = ThreadingBranch(
+            target=self._run,
+            args=(),
+            kwargs=dict(),
+            name='celery-center-profiler',
+            daemon=True
+        )
+        self._th.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample(self, own_ident: int):
+        names = {th.ident: th.name for th in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = list()
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)).replace(';', ':'))
+            stack = tuple(reversed(stack))
+            if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                self.stacks[stack] += 1
+            else:
+                self.dropped += 1
+        self.samples += 1
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            self._sample(own_ident)
+            cost = time.perf_counter() - t0
+            self.busy += cost
+            self._stop.wait(max(self.interval, cost / self.max_overhead - cost))
+        self.finished = time.time()
+
+    def collapsed(self) -> str:
+        r"""
+        Stacks in the collapsed format of flamegraph.pl / speedscope.
+        """
+        return '\n'.join(
+            f'{";".join(stack)} {count}'
+            for stack, count in self.stacks.most_common()
+        )
+
+    def top(self, n: int = 20) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        r"""
+        return: top `n` functions by self samples and by cumulative samples
+        """
+        self_count = Counter()
+        cum_count = Counter()
+        for stack, count in self.stacks.items():
+            # stack[0] is the thread name
+            if len(stack) > 1:
+                self_count[stack[-1]] += count
+            for name in set(stack[1:]):
+                cum_count[name] += count
+        return self_count.most_common(n), cum_count.most_common(n)
+
+    def result(self, top: int = 20) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        duration = end - self.started if self.started else 0.0
+        res = {
+            'done': not self.is_running,
+            'duration': duration,
+            'samples': self.samples,
+            'dropped': self.dropped,
+            'overhead': self.busy / duration if duration > 0 else 0.0,
+        }
+        if not res['done']:
+            # stacks are still being written by the sampler thread
+            return res
+        self_top, cum_top = self.top(top)
+        res['collapsed'] = self.collapsed()
+        res['self'] = self_top
+        res['cumulative'] = cum_top
+        return res
+
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+def start_session(**kwargs) -> str:
+    with _lock:
+        for session_id, sampler in _sessions.items():
+            if sampler.is_running:
+                return session_id
+        while len(_sessions) >= MAX_SESSIONS:
+            _sessions.popitem(last=False)
+        session_id = uuid.uuid4().hex
+        sampler = StackSampler(**kwargs)
+        _sessions[session_id] = sampler
+        sampler.start()
+        return session_id
+
+
+def session_result(session_id: str, top: int = 20) -> Optional[Dict[str, Any]]:
+    sampler = _sessions.get(session_id)
+    if sampler is None:
+        return None
+    return sampler.result(top=top)
+
+
+@control_command()
+def cc_profile_start(state, seconds=5.0, interval=0.01, max_depth=64):
+    r"""
+    Start sampling the stacks of this worker, return the session id.
+    Only the main process is sampled, not the children of the prefork pool.
+    """
+    return {'id': start_session(
+        seconds=float(seconds),
+        interval=float(interval),
+        max_depth=int(max_depth),
+    )}
+
+
+@inspect_command()
+def cc_profile_result(state, id=None, top=20):
+    r"""
+    Result of a sampling session, `done` is False while it is running.
+    """
+    res = session_result(id, top=int(top))
+    if res is None:
+        return {'error': f'profile session `{id}` not found'}
+    return res
@@ -0,0 +1,74 @@
+import os
+import threading
+import weakref
+from typing import Callable, Optional, Generic, TypeVar
+
+
+T = TypeVar('T')
+_worker_locals = weakref.WeakSet()
+
+
+class WorkerLocal(Generic[T]):
+    r"""
+    Resource created once per pool thread (and per process) by `factory` and
+    reused by the tasks running in that thread, e.g. DB or HTTP clients.
+
+    Example:
+    ```
+    http = WorkerLocal(requests.Session, close=lambda s: s.close())
+
+    @celery_center.task
+    def fetch(url):
+        return http.get().get(url).text
+    ```
+    Objects inherited by a forked child are not reused; the child creates
+    its own.
+    """
+    def __init__(self,
+            factory: Callable[[], T],
+            close: Optional[Callable[[T], None]] = None,
+            ):
+        self.factory = factory
+        self._close = close
+        self._local = threading.local()
+        self._objects = list()
+        self._lock = threading.Lock()
+        _worker_locals.add(self)
+
+    def get(self) -> T:
+        pid = os.getpid()
+        obj = getattr(self._local, 'obj', None)
+        if obj is None or self._local.pid != pid:
+            obj = self.factory()
+            self._local.obj, self._local.pid = obj, pid
+            with self._lock:
+                self._objects.append((pid, obj))
+        return obj
+
+    def discard(self):
+        r"""
+        Drop (and close) the object of the current thread, e.g. after a broken
+        connection; the next `get` creates a new one.
+        """
+        obj = getattr(self._local, 'obj', None)
+        if obj is None:
+            return
+        self._local.obj = None
+        with self._lock:
+            self._objects = [(p, o) for p, o in self._objects if o is not obj]
+        if self._close is not None:
+            self._close(obj)
+
+    def close_all(self):
+        pid = os.getpid()
+        with self._lock:
+            objects, self._objects = self._objects, list()
+        for p, obj in objects:
+            if p == pid and self._close is not None:
+                self._close(obj)
+        self._local = threading.local()
+
+
+def close_worker_locals():
+    for wl in list(_worker_locals):
+        wl.close_all()
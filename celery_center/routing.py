@@ -0,0 +1,184 @@
+import time
+import threading
+from typing import Callable, Optional, Dict, Any, Iterable, Mapping, Hashable, Set
+from collections import OrderedDict
+
+from celery import Celery
+
+from .control.load import QueueLoadSampler
+
+
+class LoadAwareRouter:
+    r"""
+    Route tasks marked `routable` to the least loaded eligible queue.
+
+    The load is taken from `sampler`, a callable returning the output of
+    `QueueLoadSampler.sample` (e.g. `celery_center.control.tasks.load` to
+    use the state of the worker control center). If not given, the router
+    samples the workers through the inspect API of the bound app.
+
+    Sampling never happens on the publishing thread: a stale snapshot
+    triggers a refresh in the background and the previous snapshot is used
+    meanwhile. Without any snapshot the task falls back to the static routes.
+    """
+    def __init__(self,
+            sampler: Optional[Callable[[], Dict[str, Any]]] = None,
+            ttl: float = 5.0,
+            sticky_slack: float = 2.0,
+            inspect_timeout: float = 1.0,
+            queues: Optional[Iterable[str]] = None,
+            max_sticky: int = 10000,
+            ):
+        r"""
+        ttl: seconds before a load snapshot is refreshed
+        sticky_slack: a sticky task stays on its queue while the score of the
+            queue is within `sticky_slack` times the best score
+        queues: eligible queues of the tasks added without queues, default
+            the names in `task_queues` of the app, or `task_default_queue`
+            and the queues of the mapping routes in `task_routes`
+        max_sticky: sticky keys remembered, the least recently used is
+            dropped first
+        """
+        self.sampler = sampler
+        self.ttl = ttl
+        self.sticky_slack = sticky_slack
+        self.inspect_timeout = inspect_timeout
+        self.queues = None if queues is None else set(queues)
+        self.max_sticky = max_sticky
+        self.app = None
+        self._tasks = dict()
+        self._sticky = OrderedDict()
+        self._sticky_lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_time = None
+        self._refreshing = threading.Lock()
+
+    def bind(self, celery_instance: Celery):
+        self.app = celery_instance
+        if self.sampler is None:
+            load_sampler = QueueLoadSampler()
+            def sampler():
+                inspect = celery_instance.control.inspect(
+                    timeout=self.inspect_timeout)
+                return load_sampler.sample(inspect, celery_instance)
+            self.sampler = sampler
+
+    def add_task(self,
+            name: str,
+            queues: Optional[Iterable[str]] = None,
+            sticky: Optional[Callable[..., Hashable]] = None,
+            ):
+        r"""
+        queues: eligible queues, None for the queues of the app
+        sticky: function of the task arguments returning the key of the
+            warm workspace the task needs, e.g. `lambda inputs, model: model`
+        """
+        self._tasks[name] = {
+            'queues': None if queues is None else list(queues),
+            'sticky': sticky,
+        }
+
+    def app_queues(self) -> Set[str]:
+        if self.queues is not None:
+            return self.queues
+        conf = self.app.conf
+        if conf.task_queues:
+            self.queues = {getattr(q, 'name', q) for q in conf.task_queues}
+            return self.queues
+        queues = {conf.task_default_queue}
+        routes = conf.task_routes
+        if routes is None:
+            routes = ()
+        elif not isinstance(routes, (list, tuple)):
+            routes = (routes,)
+        for route in routes:
+            if not isinstance(route, Mapping):
+                continue
+            for option in route.values():
+                if isinstance(option, str):
+                    queues.add(option)
+                elif isinstance(option, Mapping) and option.get('queue'):
+                    queues.add(getattr(option['queue'], 'name', option['queue']))
+        self.queues = queues
+        return self.queues
+
+    def _refresh(self):
+        try:
+            snapshot = self.sampler()
+        except Exception as e:
+            print(f'Fail to sample queue load: {e}')
+        else:
+            if snapshot is not None:
+                self._snapshot = snapshot
+        finally:
+            self._snapshot_time = time.monotonic()
+            self._refreshing.release()
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._snapshot_time is not None and now - self._snapshot_time < self.ttl:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    @staticmethod
+    def _scores(queues: Mapping[str, Any]) -> Dict[str, float]:
+        # estimated seconds until start when known for every candidate,
+        # otherwise tasks waiting per pool slot
+        if all(q.get('wait') is not None for q in queues.values()):
+            return {n: q['wait'] for n, q in queues.items()}
+        return {
+            n: (q['backlog'] + 1) / q['capacity']
+            for n, q in queues.items()
+        }
+
+    def select(self,
+            name: str,
+            args: Iterable[Any] = (),
+            kwargs: Optional[Mapping[str, Any]] = None,
+            ) -> Optional[str]:
+        info = self._tasks.get(name)
+        if info is None:
+            return None
+        self._maybe_refresh()
+        if self._snapshot is None:
+            return None
+
+        eligible = info['queues'] if info['queues'] is not None else self.app_queues()
+        queues = {
+            n: q for n, q in self._snapshot['queues'].items()
+            if q['capacity'] > 0 and n in eligible
+        }
+        if len(queues) == 0:
+            return None
+        scores = self._scores(queues)
+        best = min(
+            scores,
+            key=lambda n: (scores[n], queues[n]['backlog'] / queues[n]['capacity'])
+        )
+
+        if info['sticky'] is None:
+            return best
+        try:
+            key = (name, info['sticky'](*args, **(kwargs or dict())))
+            hash(key)
+        except Exception as e:
+            print(f'Fail to get sticky key of `{name}`: {e}')
+            return best
+        with self._sticky_lock:
+            queue = self._sticky.get(key)
+            if queue in scores and scores[queue] <= self.sticky_slack * scores[best]:
+                self._sticky.move_to_end(key)
+                return queue
+            self._sticky[key] = best
+            self._sticky.move_to_end(key)
+            while len(self._sticky) > self.max_sticky:
+                self._sticky.popitem(last=False)
+        return best
+
+    def __call__(self, name, args, kwargs, options, task=None, **kw):
+        queue = self.select(name, args, kwargs)
+        if queue is None:
+            return None
+        return {'queue': queue}
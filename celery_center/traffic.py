@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import atexit
+import gzip
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional, Dict, List, Any, Iterable, Tuple
+
+from celery import Celery, signals
+from celery.app.utils import find_app
+
+
+def _size(obj: Any) -> int:
+    try:
+        return len(json.dumps(obj, default=str))
+    except Exception:
+        return 0
+
+
+class TrafficRecorder:
+    r"""
+    Append a record to `path` for every task of the bound app published in
+    this process. Install by `CeleryCenter.create_celery(recorder=...)`.
+
+    The trace is a gzip file of json lines, one per published task:
+    `{"d": seconds since the previous task, "n": task name, "q": routing key,
+    "a": [size of each positional argument], "k": {name: size}}`
+    where size is the length of the argument in json.
+
+    The file is opened by the first flush of the process publishing the
+    tasks, so importing the app does not create it. `{pid}` in `path` is
+    replaced by the pid of the publishing process; without it, a process
+    forked after `bind` (e.g. a prefork child) writes to `{path}.{pid}`.
+    """
+    def __init__(self,
+            path: str,
+            sample_rate: float = 1.0,
+            flush_every: int = 100,
+            ):
+        r"""
+        sample_rate: fraction of the tasks to record
+        flush_every: records buffered before written to the file
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_every = flush_every
+        self.task_names = set()
+        self._fp = None
+        self._buffer = list()
+        self._last = None
+        self._lock = threading.Lock()
+        self._bind_pid = None
+        self._pid = None
+
+    def bind(self, celery_instance: Celery, task_names: Iterable[str]):
+        self.task_names.update(task_names)
+        self._bind_pid = self._pid = os.getpid()
+        signals.before_task_publish.connect(self._on_publish, weak=False)
+        atexit.register(self.close)
+
+    def trace_path(self) -> str:
+        pid = os.getpid()
+        if '{pid}' in self.path:
+            return self.path.format(pid=pid)
+        return self.path if pid == self._bind_pid else f'{self.path}.{pid}'
+
+    def _check_pid(self):
+        # the file and the buffer inherited from the parent belong to it
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            if self._fp is not None:
+                # detach so that closing the copy does not write a gzip
+                # trailer into the file of the parent
+                self._fp.buffer.fileobj = None
+            self._fp = None
+            self._buffer = list()
+            self._last = None
+
+    def _on_publish(self, sender=None, body=None, routing_key=None, **kwargs):
+        if sender not in self.task_names:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        args, task_kwargs = body[0], body[1]
+        now = time.monotonic()
+        record = {
+            'n': sender,
+            'q': routing_key,
+            'a': [_size(a) for a in args],
+            'k': {k: _size(v) for k, v in task_kwargs.items()},
+        }
+        with self._lock:
+            self._check_pid()
+            record['d'] = 0.0 if self._last is None else round(now - self._last, 6)
+            self._last = now
+            self._buffer.append(record)
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        self._check_pid()
+        if len(self._buffer) == 0:
+            return
+        if self._fp is None:
+            self._fp = gzip.open(self.trace_path(), 'at')
+        self._fp.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in self._buffer))
+        self._fp.flush()
+        self._buffer = list()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        signals.before_task_publish.disconnect(self._on_publish)
+        with self._lock:
+            self._flush()
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    r"""
+    Records are flushed as they are written, so the trace of a process
+    exited without `close` (e.g. a prefork child) is read up to its end.
+    """
+    records = list()
+    with gzip.open(path, 'rt') as fp:
+        try:
+            for line in fp:
+                if line.strip():
+                    records.append(json.loads(line))
+        except EOFError:
+            pass
+    return records
+
+
+def default_payload(record: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    r"""
+    Strings with the recorded json sizes. Pass `payload` to `replay` for
+    tasks which need real arguments.
+    """
+    args = ['x' * max(s - 2, 0) for s in record['a']]
+    kwargs = {k: 'x' * max(s - 2, 0) for k, s in record['k'].items()}
+    return args, kwargs
+
+
+def percentiles(values: Iterable[float], ps=(50, 90, 99, 99.9)) -> Dict[str, float]:
+    values = sorted(values)
+    if len(values) == 0:
+        return dict()
+    res = {
+        'min': values[0],
+        'max': values[-1],
+        'mean': sum(values) / len(values),
+    }
+    for p in ps:
+        idx = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+        res[f'p{p:g}'] = values[idx]
+    return res
+
+
+def replay(
+        app: Celery,
+        records: List[Dict[str, Any]],
+        speed: float = 1.0,
+        rate: Optional[float] = None,
+        payload: Callable[[Dict[str, Any]], Tuple[List[Any], Dict[str, Any]]] = default_payload,
+        keep_queues: bool = True,
+        timeout: float = 60.0,
+        ) -> Dict[str, Any]:
+    r"""
+    Send the recorded tasks open-loop: each task is sent at its scheduled
+    time whether or not the previous ones finished.
+
+    speed: replay the recorded inter-arrival times `speed` times faster
+    rate: ignore the recorded times and send `rate` tasks per second
+    return: latency percentiles in seconds (publish to `date_done` of the
+        result) and offered/achieved throughput
+    """
+    schedule = list()
+    t = 0.0
+    for record in records:
+        t += 1.0 / rate if rate is not None else record['d'] / speed
+        schedule.append(t)
+
+    sent = list()
+    start = time.monotonic()
+    lag = 0.0
+    for at, record in zip(schedule, records):
+        delay = at - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+        args, kwargs = payload(record)
+        options = {'queue': record['q']} if keep_queues and record.get('q') else dict()
+        sent_at = datetime.now(timezone.utc)
+        sent.append((sent_at, app.send_task(record['n'], args, kwargs, **options)))
+    send_seconds = time.monotonic() - start
+
+    latencies, errors = list(), 0
+    first, last = None, None
+    deadline = time.monotonic() + timeout
+    for sent_at, result in sent:
+        try:
+            result.get(timeout=max(deadline - time.monotonic(), 0.001), propagate=False)
+        except Exception:
+            errors += 1
+            continue
+        done = result.date_done
+        if not result.successful() or done is None:
+            errors += 1
+            continue
+        if done.tzinfo is None:
+            done = done.replace(tzinfo=timezone.utc)
+        latencies.append((done - sent_at).total_seconds())
+        first = sent_at if first is None else min(first, sent_at)
+        last = done if last is None else max(last, done)
+
+    span = (last - first).total_seconds() if first is not None else 0.0
+    return {
+        'n': len(records),
+        'completed': len(latencies),
+        'errors': errors,
+        'offered_per_second': len(records) / send_seconds if send_seconds > 0 else None,
+        'achieved_per_second': len(latencies) / span if span > 0 else None,
+        'max_send_lag': lag,
+        'latency_s': percentiles(latencies),
+    }
+
+
+def saturation(
+        app: Celery,
+        records: List[Dict[str, Any]],
+        rates: Iterable[float],
+        **kwargs
+        ) -> List[Dict[str, Any]]:
+    r"""
+    Replay at each fixed rate; achieved throughput flattening while latency
+    grows marks the saturation point of the workers.
+    """
+    curve = list()
+    for rate in rates:
+        res = replay(app, records, rate=rate, **kwargs)
+        res['rate'] = rate
+        curve.append(res)
+        print(
+            f'rate {rate:g}/s: achieved {res["achieved_per_second"] or 0:.1f}/s, '
+            f'p99 {res["latency_s"].get("p99", float("nan")):.3f}s, errors {res["errors"]}'
+        )
+    return curve
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Replay a recorded task trace.')
+    parser.add_argument('-A', '--app', required=True, help='celery app, e.g. app.celery')
+    parser.add_argument('trace', help='trace file written by TrafficRecorder')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay N times faster')
+    parser.add_argument('--rate', type=float, default=None, help='fixed tasks per second')
+    parser.add_argument('--rates', type=float, nargs='+', default=None, help='saturation curve')
+    parser.add_argument('--limit', type=int, default=None, help='replay the first N tasks')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('-o', '--output', default=None, help='JSON report path')
+    args = parser.parse_args(argv)
+
+    app = find_app(args.app)
+    records = load_trace(args.trace)[:args.limit]
+    if args.rates:
+        report = saturation(app, records, args.rates, timeout=args.timeout)
+    else:
+        report = replay(app, records, speed=args.speed, rate=args.rate, timeout=args.timeout)
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from celery_center.control import worker_control_center as wcc
+
+
+class StubWorkerProcess:
+    fail = set()
+    stuck = set()
+
+    def __init__(self, app_name, hostname, quiet=True, **run_config):
+        self.quiet = quiet
+        self.hostname = hostname
+        self.run_config = dict(run_config)
+        self.running = False
+        self.terminated = False
+        self.queues_updates = list()
+
+    @property
+    def is_running(self):
+        return self.running
+
+    def start(self):
+        self.running = True
+
+    def wait_for_ready(self):
+        if self.hostname in self.fail:
+            self.running = False
+        return self.running
+
+    def update_queues(self, queues):
+        self.queues_updates.append(list(queues))
+        self.run_config['queues'] = list(queues)
+
+    def shutdown(self, join=False, timeout=None):
+        if self.hostname not in self.stuck:
+            self.running = False
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+        self.running = False
+
+
+a, b = wcc.get_hostname('a'), wcc.get_hostname('b')
+
+
+class ReconcileTest(unittest.TestCase):
+    def setUp(self):
+        StubWorkerProcess.fail = set()
+        StubWorkerProcess.stuck = set()
+        patches = [
+            mock.patch.object(wcc, 'WorkerProcess', StubWorkerProcess),
+            mock.patch.object(wcc, 'find_app', lambda name: mock.Mock()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cfg_path = os.path.join(self.tmpdir.name, 'cfg.json')
+        self.wcc = wcc.WorkerControlCenter('app', cfg_path=self.cfg_path)
+
+    def saved_workers(self):
+        with open(self.cfg_path) as fp:
+            return json.load(fp)['workers']
+
+    def test_start_and_remove(self):
+        res = self.wcc.reconcile({'workers': {'a': {'pool': 'solo'}, 'b': {}}})
+        self.assertEqual(sorted(res['started']), [a, b])
+        self.assertEqual(sorted(self.saved_workers()), [a, b])
+
+        res = self.wcc.reconcile({'workers': {'a': {'pool': 'solo'}}})
+        self.assertEqual(res['stopped'], [b])
+        self.assertEqual(res['started'], [])
+        self.assertEqual(self.wcc.hostnames, [a])
+        self.assertEqual(sorted(self.saved_workers()), [a])
+
+    def test_requeue_and_restart(self):
+        self.wcc.reconcile({'workers': {'a': {'queues': ['q1']}, 'b': {'pool': 'solo'}}})
+        worker = self.wcc.nodes[a]
+        res = self.wcc.reconcile({'workers': {'a': {'queues': ['q2']}, 'b': {'pool': 'threads'}}})
+        self.assertEqual(res['requeued'], [a])
+        self.assertEqual(res['restarted'], [b])
+        self.assertIs(self.wcc.nodes[a], worker)
+        self.assertEqual(worker.queues_updates, [['q2']])
+        self.assertEqual(self.saved_workers()[a]['queues'], ['q2'])
+        self.assertEqual(self.saved_workers()[b]['pool'], 'threads')
+
+    def test_unchanged(self):
+        self.wcc.reconcile({'workers': {'a': {'pool': 'solo'}}})
+        worker = self.wcc.nodes[a]
+        res = self.wcc.reconcile({'workers': {'a': {'pool': 'solo'}}})
+        self.assertEqual(sum(len(v) for v in res.values()), 0)
+        self.assertIs(self.wcc.nodes[a], worker)
+
+    def test_failed_start_is_kept(self):
+        StubWorkerProcess.fail = {a}
+        res = self.wcc.reconcile({'workers': {'a': {}, 'b': {}}})
+        self.assertEqual(res['failed'], [a])
+        self.assertEqual(res['started'], [b])
+        self.assertEqual(sorted(self.saved_workers()), [a, b])
+
+    def test_stuck_worker_is_terminated(self):
+        StubWorkerProcess.stuck = {a}
+        self.wcc.reconcile({'workers': {'a': {}}})
+        worker = self.wcc.nodes[a]
+        res = self.wcc.reconcile({'workers': dict()}, timeout=0.01)
+        self.assertEqual(res['stopped'], [a])
+        self.assertTrue(worker.terminated)
+        self.assertEqual(self.wcc.hostnames, [])
+
+    def test_global_only_edit(self):
+        with open(self.cfg_path, 'w') as fp:
+            json.dump({'global': {'workers': {'pool': 'solo'}}, 'workers': {'a': {}}}, fp)
+        self.wcc = wcc.WorkerControlCenter('app', cfg_path=self.cfg_path)
+        self.wcc.start()
+        self.assertEqual(self.wcc.nodes[a].run_config['pool'], 'solo')
+        self.assertNotIn('pool', self.saved_workers()[a])
+
+        with open(self.cfg_path) as fp:
+            data = json.load(fp)
+        data['global']['workers']['pool'] = 'threads'
+        with open(self.cfg_path, 'w') as fp:
+            json.dump(data, fp)
+        os.utime(self.cfg_path, ns=(0, 0))
+        res = self.wcc._reload(self.cfg_path)
+        self.assertEqual(res['restarted'], [a])
+        self.assertEqual(self.wcc.nodes[a].run_config['pool'], 'threads')
+        self.assertNotIn('pool', self.saved_workers()[a])
+
+    def edit_config(self, workers):
+        with open(self.cfg_path) as fp:
+            data = json.load(fp)
+        data['workers'] = workers
+        with open(self.cfg_path, 'w') as fp:
+            json.dump(data, fp)
+        os.utime(self.cfg_path, ns=(0, 0))
+
+    def test_pending_edit_applied_before_save(self):
+        self.wcc.reconcile({'workers': {'a': {}}})
+        self.wcc._watching.set()
+        self.addCleanup(self.wcc._watching.clear)
+        self.edit_config({a: {}, b: {}})
+        self.wcc.start_worker('c', dict())
+        c = wcc.get_hostname('c')
+        self.assertEqual(sorted(self.wcc.hostnames), [a, b, c])
+        self.assertEqual(sorted(self.saved_workers()), [a, b, c])
+
+    def test_pending_edit_not_overwritten(self):
+        self.wcc.reconcile({'workers': {'a': {}}})
+        self.wcc._watching.set()
+        self.addCleanup(self.wcc._watching.clear)
+        self.edit_config({a: {}, b: {}})
+        self.wcc.save_config()
+        self.assertEqual(sorted(self.saved_workers()), [a, b])
+
+    def test_unwatch_does_not_wait_interval(self):
+        self.wcc.save_config()
+        self.wcc.watch(interval=60)
+        t = time.monotonic()
+        self.wcc.unwatch()
+        self.assertLess(time.monotonic() - t, 5)
+        self.assertIsNone(self.wcc._watcher)
+
+    def test_saved_once(self):
+        with mock.patch.object(self.wcc, 'save_config') as save_config:
+            self.wcc.reconcile({'workers': {'a': {}, 'b': {}}})
+        self.assertEqual(save_config.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import time
+import threading
+import unittest
+
+from celery import Celery
+from kombu import Queue
+
+from celery_center.routing import LoadAwareRouter
+
+
+def queue(backlog=0, capacity=1, wait=None):
+    return {'workers': 1, 'backlog': backlog, 'capacity': capacity,
+            'throughput': None, 'wait': wait}
+
+
+class LoadAwareRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Celery(broker='memory://')
+        self.app.conf.task_queues = [Queue('q1'), Queue('q2'), Queue('q3')]
+        self.snapshot = {'time': 0, 'queues': dict(), 'workers': dict()}
+        self.router = self.bind(LoadAwareRouter(sampler=lambda: self.snapshot, ttl=3600))
+
+    def bind(self, router):
+        router.bind(self.app)
+        return router
+
+    def prime(self, router=None):
+        r"""
+        Wait for the background refresh started by the first select().
+        """
+        router = router or self.router
+        router.add_task('prime', queues=[])
+        self.assertIsNone(router.select('prime'))
+        deadline = time.monotonic() + 5
+        while router._snapshot is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(router._snapshot)
+
+    def test_no_snapshot_falls_back(self):
+        sampled = threading.Event()
+        def sampler():
+            sampled.wait(5)
+            return self.snapshot
+        router = self.bind(LoadAwareRouter(sampler=sampler, ttl=3600))
+        router.add_task('t', queues=['q1'])
+        self.snapshot['queues'] = {'q1': queue()}
+        # publishing does not wait for the sampler
+        self.assertIsNone(router('t', (), dict(), dict()))
+        sampled.set()
+        self.prime(router)
+        self.assertEqual(router('t', (), dict(), dict()), {'queue': 'q1'})
+
+    def test_not_routable(self):
+        self.snapshot['queues'] = {'q1': queue()}
+        self.prime()
+        self.assertIsNone(self.router.select('other'))
+
+    def test_scores_by_wait(self):
+        self.router.add_task('t')
+        self.snapshot['queues'] = {
+            'q1': queue(backlog=10, capacity=1, wait=0.5),
+            'q2': queue(backlog=1, capacity=1, wait=2.0),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('t'), 'q1')
+
+    def test_scores_by_backlog_when_wait_unknown(self):
+        self.router.add_task('t')
+        self.snapshot['queues'] = {
+            'q1': queue(backlog=10, capacity=1, wait=0.5),
+            'q2': queue(backlog=3, capacity=4, wait=None),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('t'), 'q2')
+
+    def test_tie_broken_by_backlog_per_slot(self):
+        self.router.add_task('t')
+        self.snapshot['queues'] = {
+            'q1': queue(backlog=2, capacity=4, wait=0.0),
+            'q2': queue(backlog=1, capacity=4, wait=0.0),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('t'), 'q2')
+
+    def test_no_capacity_excluded(self):
+        self.router.add_task('t')
+        self.snapshot['queues'] = {
+            'q1': queue(backlog=0, capacity=0),
+            'q2': queue(backlog=5, capacity=1),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('t'), 'q2')
+        self.snapshot['queues'] = {'q1': queue(capacity=0)}
+        self.assertIsNone(self.router.select('t'))
+
+    def test_eligible_task_queues(self):
+        self.router.add_task('any')
+        self.router.add_task('listed', queues=['q2'])
+        self.snapshot['queues'] = {
+            'foreign': queue(backlog=0, capacity=8),
+            'q1': queue(backlog=1, capacity=1),
+            'q2': queue(backlog=5, capacity=1),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('any'), 'q1')
+        self.assertEqual(self.router.select('listed'), 'q2')
+
+    def test_eligible_default_and_routes(self):
+        self.app.conf.task_queues = None
+        self.app.conf.task_routes = {'a': {'queue': 'q1'}, 'b': 'q2'}
+        router = self.bind(LoadAwareRouter(sampler=lambda: self.snapshot, ttl=3600))
+        self.assertEqual(router.app_queues(), {'celery', 'q1', 'q2'})
+
+    def test_eligible_explicit(self):
+        router = self.bind(LoadAwareRouter(
+            sampler=lambda: self.snapshot, ttl=3600, queues=['foreign']))
+        router.add_task('t')
+        self.snapshot['queues'] = {
+            'foreign': queue(backlog=5, capacity=1),
+            'q1': queue(backlog=0, capacity=1),
+        }
+        self.prime(router)
+        self.assertEqual(router.select('t'), 'foreign')
+
+    def test_sticky_within_slack(self):
+        self.router.add_task('t', sticky=lambda model: model)
+        self.snapshot['queues'] = {
+            'q1': queue(backlog=0, capacity=1, wait=1.0),
+            'q2': queue(backlog=0, capacity=1, wait=1.5),
+        }
+        self.prime()
+        self.assertEqual(self.router.select('t', ('m',)), 'q1')
+        # q1 busier but within sticky_slack (2x) of q2
+        self.snapshot['queues']['q1']['wait'] = 2.5
+        self.assertEqual(self.router.select('t', ('m',)), 'q1')
+        self.assertEqual(self.router.select('t', ('n',)), 'q2')
+        # beyond the slack the key moves to the best queue
+        self.snapshot['queues']['q1']['wait'] = 4.0
+        self.assertEqual(self.router.select('t', ('m',)), 'q2')
+        self.snapshot['queues']['q1']['wait'] = 1.0
+        self.assertEqual(self.router.select('t', ('m',)), 'q2')
+
+    def test_sticky_lru(self):
+        router = self.bind(LoadAwareRouter(
+            sampler=lambda: self.snapshot, ttl=3600, max_sticky=2))
+        router.add_task('t', sticky=lambda model: model)
+        self.snapshot['queues'] = {'q1': queue(), 'q2': queue(backlog=1)}
+        self.prime(router)
+        router.select('t', ('a',))
+        router.select('t', ('b',))
+        router.select('t', ('a',))
+        router.select('t', ('c',))
+        self.assertEqual(list(router._sticky), [('t', 'a'), ('t', 'c')])
+
+    def test_sticky_failure_falls_back(self):
+        def sticky(model):
+            raise KeyError(model)
+        self.router.add_task('t', sticky=sticky)
+        self.router.add_task('u', sticky=lambda model: [model])
+        self.snapshot['queues'] = {'q1': queue(), 'q2': queue(backlog=1)}
+        self.prime()
+        self.assertEqual(self.router.select('t', ('m',)), 'q1')
+        self.assertEqual(self.router.select('u', ('m',)), 'q1')
+        self.assertEqual(len(self.router._sticky), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()